@@ -0,0 +1,259 @@
+"""
+Parse throughput regression checks against recorded baselines.
+
+Replays a corpus of My-files (Mybuild, *.my and .config files found under
+a directory) through each layer of the parser separately:
+
+  lex       the PLY lexer alone,
+  bulk_lex  the bulk lexer used by the loader,
+  grammar   the grammar with all actions replaced by no-ops,
+  full      loader.load_sources(), including construction of module
+            classes, the way a tree is actually loaded.
+
+For each layer tokens/sec, files/sec and peak memory (as seen by
+tracemalloc) are measured and compared against a baseline JSON file, along
+with the number of tokens produced by the lexers, which must match exactly.
+A baseline may omit any of the metrics, e.g. the rates, which are only
+comparable on the same machine. The time of each layer relative to the time
+of the lex layer in the same run is not, so it is checked everywhere.
+Usage:
+
+    python -m mybuild_embox.lang_legacy.bench CORPUS --baseline FILE [--record]
+"""
+from __future__ import print_function
+
+from _compat import *
+
+import io
+import json
+import os
+import sys
+import time
+import types
+from array import array
+
+import ply.yacc
+
+from mybuild_embox.lang_legacy import lex
+from mybuild_embox.lang_legacy import loader
+from mybuild_embox.lang_legacy import parse
+from mylang.location import Fileinfo
+
+
+LAYERS = ['lex', 'bulk_lex', 'grammar', 'full']
+
+# Higher is better for rates, lower is better for memory and time, and
+# counts must not change at all.
+METRICS = {
+    'tokens':          0,
+    'relative_time':  -1,
+    'tokens_per_sec': +1,
+    'files_per_sec':  +1,
+    'peak_memory':    -1,
+}
+
+DEFAULT_TOLERANCE = 0.2
+
+
+def is_my_file(filename):
+    return (filename == 'Mybuild' or filename.endswith('.my') or
+            filename.endswith('.config'))
+
+def load_corpus(corpus_dir):
+    """Returns a sorted list of (filename, source) pairs."""
+    corpus = []
+    for dirpath, dirnames, filenames in os.walk(corpus_dir):
+        dirnames.sort()
+        for filename in sorted(filter(is_my_file, filenames)):
+            filename = os.path.join(dirpath, filename)
+            with io.open(filename, encoding='utf-8') as f:
+                corpus.append((filename, f.read()))
+    return corpus
+
+
+def ply_lexer(source, filename):
+    lx = lex.lexer.clone()
+    lx.fileinfo = Fileinfo(source, filename)
+    lx.locs = array('l')
+    lx.ignore_newline_stack = [0]
+    return lx
+
+def iter_tokens(source, filename):
+    lx = ply_lexer(source, filename)
+    lx.input(source)
+    return iter(lx.token, None)
+
+
+def _noop_action(name, doc):
+    def action(p):
+        p[0] = None
+    action.__name__ = name
+    action.__doc__ = doc
+    return action
+
+def noop_parser():
+    """Builds a parser for the same grammar with no-op actions."""
+    grammar = types.ModuleType(__name__ + '.noop_grammar')
+    grammar.__file__ = parse.__file__
+    grammar.tokens = parse.tokens
+    grammar.p_error = parse.p_error
+
+    for name, func in vars(parse).items():
+        if name.startswith('p_') and name != 'p_error':
+            setattr(grammar, name, _noop_action(name, func.__doc__))
+
+    return ply.yacc.yacc(module=grammar, start='my_file',
+                         errorlog=ply.yacc.NullLogger(), debug=False,
+                         write_tables=False)
+
+
+class Layers(object):
+    """Runs the corpus through each of the layers."""
+
+    def __init__(self, corpus):
+        super(Layers, self).__init__()
+        self.corpus = corpus
+        self.grammar_parser = noop_parser()
+
+    def run_lex(self):
+        nr_tokens = 0
+        for filename, source in self.corpus:
+            for _ in iter_tokens(source, filename):
+                nr_tokens += 1
+        return nr_tokens
+
+    def run_bulk_lex(self):
+        nr_tokens = 0
+        for filename, source in self.corpus:
+            nr_tokens += len(loader.new_lexer(source, filename).tokens)
+        return nr_tokens
+
+    def run_grammar(self):
+        for filename, source in self.corpus:
+            self.grammar_parser.parse(source,
+                                      lexer=ply_lexer(source, filename),
+                                      tracking=True)
+
+    def run_full(self):
+        loader.load_sources(self.corpus)
+
+
+def measure(layers, repeat=3):
+    """Returns {layer: {metric: value}} for the best of several runs."""
+    import gc
+    import tracemalloc
+
+    nr_tokens = layers.run_lex()
+    nr_files = len(layers.corpus)
+
+    results = {}
+    times = {}
+    for layer in LAYERS:
+        run = getattr(layers, 'run_' + layer)
+
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        best = times[layer] = max(best, 1e-9)
+
+        # Garbage left by previous runs is not collected while tracing, so
+        # that the peak only depends on the run itself.
+        peak = None
+        for _ in range(repeat):
+            gc.collect()
+            gc.disable()
+            tracemalloc.start()
+            try:
+                count = run()
+                _, run_peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+                gc.enable()
+            peak = run_peak if peak is None else min(peak, run_peak)
+
+        results[layer] = {
+            'tokens_per_sec': nr_tokens / best,
+            'files_per_sec':  nr_files / best,
+            'peak_memory':    peak,
+        }
+        if count is not None:
+            results[layer]['tokens'] = count
+
+    for layer in LAYERS:
+        results[layer]['relative_time'] = times[layer] / times['lex']
+
+    return results
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Returns a list of human-readable regressions, empty if there are
+    none."""
+    regressions = []
+    for layer in LAYERS:
+        for metric, sign in sorted(METRICS.items()):
+            try:
+                expected = baseline[layer][metric]
+            except KeyError:
+                continue
+            try:
+                actual = results[layer][metric]
+            except KeyError:
+                regressions.append('{layer}: {metric} is not measured'
+                                   .format(**locals()))
+                continue
+
+            if sign == 0:
+                bad = actual != expected
+            elif sign > 0:
+                bad = actual < expected * (1 - tolerance)
+            else:
+                bad = actual > expected * (1 + tolerance)
+
+            if bad:
+                regressions.append('{layer}: {metric} is {actual:.6g}, '
+                                   'baseline {expected:.6g}'
+                                   .format(**locals()))
+    return regressions
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('corpus', help='directory with My-files')
+    parser.add_argument('--baseline', required=True,
+                        help='baseline JSON file')
+    parser.add_argument('--record', action='store_true',
+                        help='overwrite the baseline with the new results')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='allowed relative degradation '
+                             '(default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='timed runs per layer (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    layers = Layers(load_corpus(args.corpus))
+    results = measure(layers, args.repeat)
+
+    for layer in LAYERS:
+        print('{0:8} {tokens_per_sec:12.0f} tok/s {files_per_sec:10.1f} '
+              'files/s {peak_memory:12d} B peak'
+              .format(layer, **results[layer]))
+
+    if args.record:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print('REGRESSION: ' + regression, file=sys.stderr)
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
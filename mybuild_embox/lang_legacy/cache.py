@@ -0,0 +1,138 @@
+"""
+Memory-bounded cache of loaded My-files.
+"""
+from __future__ import print_function
+
+from _compat import *
+
+from collections import defaultdict
+from collections import OrderedDict
+
+from mybuild_embox.lang_legacy import loader
+
+
+def _closure(filenames, deps):
+    """Returns the filenames along with everything reachable from them."""
+    seen = set()
+    stack = list(filenames)
+    while stack:
+        filename = stack.pop()
+        if filename not in seen:
+            seen.add(filename)
+            stack.extend(deps.get(filename, ()))
+    return seen
+
+
+class ParseCache(object):
+    """
+    Keeps files loaded with loader.load(..., cache=...) under a memory budget.
+
+    The budget is measured in characters of source text of the files whose
+    modules are held, which is what both the source itself and the module
+    classes built from it scale with. Once it is exceeded after a load,
+    least recently used files are evicted: their modules are dropped from
+    the module and package globals, so that nothing keeps them (and their
+    compiled lambdas) alive.
+
+    Files referring to modules of an evicted file are evicted along with
+    it, as their classes would otherwise keep the old modules alive (or
+    fail to find them). Therefore, files of the active configuration and
+    everything they refer to, directly or not, are never evicted, and
+    neither are files of the load that has exceeded the budget. An evicted
+    file is read and loaded anew the next time it is asked for.
+
+    Files are loaded into the packages (a loader.Packages) given, or into
+    a namespace of the cache's own.
+    """
+
+    def __init__(self, budget=None, read_source=loader.read_source,
+                 packages=None):
+        super(ParseCache, self).__init__()
+        self.budget = budget
+        self.read_source = read_source
+        self.packages = packages if packages is not None else loader.Packages()
+        self.size = 0
+        self._entries = OrderedDict()  # filename -> loader.LoadedFile
+        self._active = frozenset()
+
+    def __contains__(self, filename):
+        return filename in self._entries
+
+    def activate(self, filenames):
+        """Sets files of the active configuration, evicting the rest if
+        necessary."""
+        self._active = frozenset(filenames)
+        self._shrink()
+
+    def load(self, filenames, new_module_globals=None, jobs=1):
+        """Loads the files not in the cache yet, see loader.load()."""
+        if new_module_globals is None:
+            new_module_globals = self.packages
+        filenames = list(filenames)
+
+        results = {}
+        missing = []
+        for filename in filenames:
+            try:
+                entry = self._entries.pop(filename)
+            except KeyError:
+                missing.append(filename)
+            else:
+                self._entries[filename] = entry  # most recently used go last
+                results[filename] = entry.modules
+
+        sources = ((filename, self.read_source(filename))
+                   for filename in missing)
+        for entry in loader.iter_load_sources(sources, new_module_globals,
+                                              jobs):
+            self._entries[entry.scan.filename] = entry
+            self.size += entry.size
+            results[entry.scan.filename] = entry.modules
+
+        self._shrink(filenames)
+        return results
+
+    def evict(self, filename):
+        """Evicts the file along with all files referring to it."""
+        deps = self._deps()
+        if filename in _closure(self._active, deps):
+            raise ValueError('{0} is used by the active configuration'
+                             .format(filename))
+        for user in _closure([filename], self._users(deps)):
+            self._drop(user)
+
+    def _deps(self):
+        return loader.file_deps([entry.scan
+                                 for entry in self._entries.values()])
+
+    def _users(self, deps):
+        users = defaultdict(set)
+        for filename, file_deps in deps.items():
+            for dep in file_deps:
+                users[dep].add(filename)
+        return users
+
+    def _drop(self, filename):
+        entry = self._entries.pop(filename)
+        self.size -= entry.size
+
+        module_globals = entry.module_globals
+        for name, module in entry.modules.items():
+            if module_globals.get(name) is module:
+                del module_globals[name]
+
+    def _shrink(self, loading=()):
+        if self.budget is None or self.size <= self.budget:
+            return
+
+        deps = self._deps()
+        kept = _closure(self._active.union(loading), deps)
+        users = self._users(deps)
+
+        for filename in list(self._entries):
+            if self.size <= self.budget:
+                break
+            if filename in self._entries and filename not in kept:
+                # Users of a file not kept are not kept either.
+                for user in _closure([filename], users):
+                    self._drop(user)
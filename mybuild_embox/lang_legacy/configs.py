@@ -0,0 +1,119 @@
+"""
+Evaluation of many configurations against a single parsed tree.
+"""
+from __future__ import print_function
+
+from _compat import *
+
+import multiprocessing
+import pickle
+import traceback
+from collections import namedtuple
+
+from mybuild_embox.lang_legacy import loader
+from mybuild_embox.lang_legacy import parse
+
+
+class ConfigResult(namedtuple('_ConfigResult', 'filename value error')):
+    """Outcome of evaluating a configuration file: either the value returned
+    by the evaluation function or the exception it raised."""
+    __slots__ = ()
+
+
+class ConfigError(Exception):
+    """Stands for a value or an exception of a configuration that could not
+    be sent back from a worker. Its message has the repr of the original
+    object and the traceback, if any."""
+
+
+# Set in the parent before forking the pool, inherited by the workers.
+_evaluate = None
+_new_module_globals = None
+
+def _evaluate_config(filename):
+    tb = ''
+    try:
+        lx = loader.new_lexer(loader.read_source(filename), filename)
+        s = loader.scan_lexer(lx)
+        form = parse.my_parse_lexer(lx)
+        module_globals = _new_module_globals(filename, s.package)
+        modules = form.build(module_globals, lx.fileinfo,
+                             (s.package, s.package_pos),
+                             package_globals=module_globals)
+        result = ConfigResult(filename, _evaluate(modules), None)
+
+    except Exception as e:
+        result = ConfigResult(filename, None, e)
+        tb = traceback.format_exc()
+
+    # Pickle it here, so that a result that cannot be sent back only fails
+    # its own config instead of the whole pool.
+    try:
+        return filename, pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        obj = result.value if result.error is None else result.error
+        error = ConfigError('{0!r}\n{1}'.format(obj, tb))
+        return filename, pickle.dumps(ConfigResult(filename, None, error),
+                                      pickle.HIGHEST_PROTOCOL)
+
+def _load_result(filename, data):
+    try:
+        return pickle.loads(data)
+    except Exception:
+        return ConfigResult(filename, None,
+                            ConfigError(traceback.format_exc()))
+
+
+def _materialize(loaded):
+    """Evaluates class-level members of the loaded modules, so that workers
+    share the values instead of computing each its own copy. Modules that
+    fail to evaluate are left to fail in the workers using them."""
+    for modules in loaded.values():
+        for module in modules.values():
+            try:
+                parse.materialize([module])
+            except Exception:
+                pass
+
+
+def evaluate_configs(tree_filenames, config_filenames, evaluate,
+                     new_module_globals=None, jobs=None, cache=None):
+    """
+    Loads the tree once (through the cache, a ParseCache, if any) and then
+    evaluates each of the configuration files on top of it. Both the tree
+    is parsed and the configs are evaluated in pools of 'jobs' worker
+    processes.
+
+    Workers are forked after the tree is loaded, so they share its modules
+    copy-on-write instead of parsing them again. A worker evaluates a single
+    config file: it is built into its package, and evaluate() is called
+    with a dict of the resulting modules. A return value or an exception
+    that cannot be pickled is reported as a ConfigError. Nothing a worker
+    does is visible to the others or to the caller.
+
+    Yields a ConfigResult for each config file as soon as it is done, in
+    the order of completion.
+    """
+    global _evaluate, _new_module_globals
+
+    if new_module_globals is None:
+        new_module_globals = (cache.packages if cache is not None else
+                              loader.Packages())
+
+    _materialize(loader.load(tree_filenames, new_module_globals, cache,
+                             jobs))
+
+    _evaluate = evaluate
+    _new_module_globals = new_module_globals
+
+    # Each config gets a fresh worker, so that whatever the previous ones
+    # put into the packages or the tree modules is gone.
+    pool = multiprocessing.get_context('fork').Pool(jobs, maxtasksperchild=1)
+    try:
+        for filename, data in pool.imap_unordered(_evaluate_config,
+                                                  config_filenames):
+            yield _load_result(filename, data)
+    finally:
+        pool.terminate()
+        pool.join()
+        _evaluate = _new_module_globals = None
@@ -1,6 +1,8 @@
 from _compat import *
 
 import ast
+import functools
+import re
 
 import ply.lex
 
@@ -98,7 +100,7 @@ def t_ID(t):
 
 # A regular expression rule with some action code
 def t_NUMBER(t):
-    r'(?i)0x[0-9a-f]+|0[0-7]*|[1-9]\d*'
+    r'0[xX][0-9a-fA-F]+|0[0-7]*|[1-9]\d*'
     if t.value[0] == '0' and t.value[:2].lower() != '0x':
         t.value = int(t.value.lstrip('0') or '0', base=8)
     else:
@@ -125,5 +127,154 @@ def t_error(t):
 lexer = ply.lex.lex()
 lexer.ignore_newline_stack = [0]
 
+
+# Bulk scanning: the whole buffer is split into tokens in a single finditer
+# pass over a master regex, without calling a Python function per token.
+# The master regex is built from the t_* rules above, tried in the same order
+# as PLY does: functions in the order of definition, then strings by
+# decreasing regex length.
+
+def _bulk_rules():
+    funcs = []
+    strings = []
+    for name, rule in list(globals().items()):
+        if not name.startswith('t_') or name in ('t_ignore', 't_error'):
+            continue
+        if callable(rule):
+            funcs.append(rule)
+        else:
+            strings.append((name[2:], rule))
+
+    funcs.sort(key=lambda func: func.__code__.co_firstlineno)
+    strings.sort(key=lambda rule: len(rule[1]), reverse=True)
+
+    return ([('ignore', '[{0}]+'.format(re.escape(t_ignore)))] +
+            [(func.__name__[2:], func.__doc__) for func in funcs] + strings)
+
+_bulk_re = re.compile('|'.join('(?P<{0}>{1})'.format(name, regex)
+                               for name, regex in _bulk_rules()), re.VERBOSE)
+
+# Rule functions, called for kinds that have no fast path in bulk_tokens.
+_bulk_funcs = dict((name[2:], rule) for name, rule in list(globals().items())
+                   if name.startswith('t_') and name != 't_error' and
+                   callable(rule))
+
+# Kinds of rule functions that only count parens, which nothing needs once
+# all tokens are scanned.
+_bulk_plain = frozenset(['LPAREN', 'RPAREN', 'LBRACKET', 'RBRACKET',
+                         'LBRACE', 'RBRACE'])
+
+
+def _number(s):
+    if s[0] != '0':
+        return int(s)
+    if len(s) == 1:
+        return 0
+    if s[1] in 'xX':
+        return int(s[2:], 16)
+    return int(s, 8)
+
+
+def bulk_tokens(data, lexer=None, lineno=1):
+    """
+    Returns a list of all tokens of data.
+
+    Identifiers, numbers, strings and newlines are handled in place, the
+    same way as t_ID, t_NUMBER, t_STRING and t_NEWLINE do. Other rule
+    functions (if any) are called as usual.
+    """
+    if lexer is None:
+        lexer = BulkLexer()
+
+    toks = []
+    append = toks.append
+    get_type = reserved.get
+    LexToken = ply.lex.LexToken
+
+    pos = 0
+    for m in _bulk_re.finditer(data):
+        lexpos = m.start()
+        if lexpos != pos:
+            break  # skipped an illegal character
+        pos = m.end()
+
+        kind = m.lastgroup
+        value = m.group()
+
+        if kind == 'NEWLINE':
+            lineno += value.count('\n')
+            continue
+        if kind.startswith('ignore'):
+            continue
+
+        t = LexToken()
+        t.lineno = lineno
+        t.lexpos = lexpos
+
+        if kind == 'ID':
+            t.type = get_type(value, 'ID')
+            if value[0] == '^':
+                value = value[1:]
+        elif kind == 'NUMBER':
+            t.type = kind
+            value = _number(value)
+        elif kind == 'STRING':
+            t.type = kind
+            lineno += value.count('\n')
+            value = ast.literal_eval(value)
+        elif kind in _bulk_plain or kind not in _bulk_funcs:
+            t.type = kind
+        else:
+            t.type = kind
+            t.value = value
+            t.lexer = lexer
+            lexer.lineno = lineno
+            t = _bulk_funcs[kind](t)
+            lineno = lexer.lineno
+            if t is not None:
+                append(t)
+            continue
+
+        t.value = value
+        append(t)
+
+    if pos != len(data):
+        t = LexToken()
+        t.type = 'error'
+        t.value = data[pos:]
+        t.lineno = lineno
+        t.lexpos = pos
+        t.lexer = lexer
+        t_error(t)
+
+    return toks
+
+
+class BulkLexer(object):
+    """
+    A drop-in replacement for the lexer that scans all tokens at once upon
+    input() and then hands them out of the pre-built list.
+    """
+
+    def __init__(self):
+        super(BulkLexer, self).__init__()
+        self.lineno = 1
+        self.lexpos = 0
+        self.ignore_newline_stack = [0]
+        self.tokens = []
+        self._next_token = functools.partial(next, iter(()), None)
+
+    def input(self, data):
+        self.tokens = bulk_tokens(data, self, self.lineno)
+        self._next_token = functools.partial(next, iter(self.tokens), None)
+
+    def token(self):
+        t = self._next_token()
+        if t is not None:
+            self.lineno = t.lineno
+            self.lexpos = t.lexpos
+        return t
+
+
 if __name__ == "__main__":
     ply.lex.runmain(lexer)
@@ -0,0 +1,383 @@
+"""
+Loading of My-files in the order of module inheritance.
+
+Since p_module_type evaluates 'extends' eagerly, a base module must be built
+before any module extending it. The loader first scans tokens of every file
+to find out which modules it defines and extends, and then parses the same
+tokens file by file (possibly in worker processes), level by level of the
+resulting dependency graph.
+"""
+from __future__ import print_function
+
+from _compat import *
+
+import hashlib
+import io
+import itertools
+import multiprocessing
+import types
+from collections import defaultdict
+from collections import namedtuple
+from collections import OrderedDict
+
+from mybuild_embox.lang_legacy import lex
+from mybuild_embox.lang_legacy import runtime
+from mybuild_embox.lang_legacy.parse import my_parse_lexer
+from mylang.location import Fileinfo
+
+
+def read_source(filename):
+    with io.open(filename, encoding='utf-8') as f:
+        return f.read()
+
+
+# Scanning.
+
+def new_lexer(source, filename):
+    """Returns a bulk lexer with all tokens of the source scanned already."""
+    lx = lex.BulkLexer()
+    lx.fileinfo = Fileinfo(source, filename)
+    lx.input(source)
+    return lx
+
+def _qualname(tokens, first=None):
+    """Reads 'name(.name)*' and returns it along with the next token."""
+    names = []
+    if first is not None:
+        tokens = itertools.chain([first], tokens)
+    for t in tokens:
+        if t.type != ('ID' if len(names) % 2 == 0 else 'PERIOD'):
+            break
+        names.append(t.value)
+    else:
+        t = None
+    return ''.join(names).rstrip('.') or None, t
+
+class FileScan(namedtuple('_FileScan',
+                          'filename package package_pos '
+                          'modules bases refs digest')):
+    """
+    What a file declares: its package (and the (lineno, lexpos) of its
+    name), names of the modules it defines, names of the modules they
+    extend and a set of all other (possibly qualified) names it refers to,
+    as written in the source.
+
+    The digest is a hash of the file contents following the package
+    declaration, along with the line and column they start at. Files that
+    only differ in their package share it, and so do all positions within
+    their bodies.
+    """
+    __slots__ = ()
+
+def scan_lexer(lx):
+    """Scans tokens of a lexer returned by new_lexer(), which can then be
+    passed to my_parse_lexer()."""
+    source = lx.fileinfo.source
+    filename = lx.fileinfo.name
+    tokens = iter(lx.tokens)
+    package = None
+    package_pos = None
+    body_start = 0
+    body_lineno = 1
+    modules = []
+    bases = []
+    refs = set()
+
+    depth = 0
+    t = next(tokens, None)
+    while t is not None:
+        if t.type == 'LBRACE':
+            depth += 1
+        elif t.type == 'RBRACE':
+            depth -= 1
+
+        elif depth == 0 and t.type == 'E_PACKAGE' and package is None:
+            t = next(tokens, None)
+            if t is not None:
+                package_pos = t.lineno, t.lexpos
+            package, t = _qualname(tokens, t)
+            body_start = t.lexpos if t is not None else len(source)
+            body_lineno = t.lineno if t is not None else source.count('\n')+1
+            continue
+
+        elif depth == 0 and t.type == 'E_MODULE':
+            t = next(tokens, None)
+            if t is not None and t.type == 'ID':
+                modules.append(t.value)
+                t = next(tokens, None)
+            if t is not None and t.type == 'E_EXTENDS':
+                base, t = _qualname(tokens)
+                if base is not None:
+                    bases.append(base)
+            continue
+
+        elif t.type == 'ID':
+            ref, t = _qualname(tokens, t)
+            refs.add(ref)
+            continue
+
+        t = next(tokens, None)
+
+    body_column = body_start - (source.rfind('\n', 0, body_start) + 1)
+    body = u'{0}:{1}:'.format(body_lineno, body_column) + source[body_start:]
+    digest = hashlib.sha1(body.encode('utf-8')).hexdigest()
+
+    return FileScan(filename, package, package_pos, modules, bases,
+                    frozenset(refs), digest)
+
+def scan(source, filename):
+    return scan_lexer(new_lexer(source, filename))
+
+def scan_file(filename):
+    return scan(read_source(filename), filename)
+
+
+# Ordering.
+
+def _qualify(package, name):
+    return package + '.' + name if package else name
+
+def _defined_in(scans):
+    defined_in = {}
+    for s in scans:
+        for name in s.modules:
+            defined_in[_qualify(s.package, name)] = s.filename
+    return defined_in
+
+def _resolve(defined_in, package, name):
+    """Returns a file defining a module the name refers to, if any. A name
+    may also refer to an attribute of a module, so its prefixes are tried
+    as well."""
+    for qualname in _qualify(package, name), name:
+        while qualname:
+            filename = defined_in.get(qualname)
+            if filename is not None:
+                return filename
+            qualname = qualname.rpartition('.')[0]
+
+def file_deps(scans):
+    """
+    Returns a dict mapping each filename to a set of other files defining
+    modules it refers to in any way, be it its bases or names used lazily
+    in its annotations and lists.
+    """
+    defined_in = _defined_in(scans)
+
+    deps = {}
+    for s in scans:
+        deps[s.filename] = found = set()
+        for name in s.refs.union(s.bases):
+            dep = _resolve(defined_in, s.package, name)
+            if dep is not None and dep != s.filename:
+                found.add(dep)
+    return deps
+
+def load_levels(scans):
+    """
+    Groups files into levels so that every base module is defined in a
+    file of one of the preceding levels. Files within a level do not depend
+    on each other. Bases defined outside of the scanned files are assumed
+    to be available already.
+
+    Returns a list of lists of filenames.
+    """
+    defined_in = _defined_in(scans)
+
+    deps = {}
+    users = defaultdict(list)
+    for s in scans:
+        deps[s.filename] = set()
+        for base in s.bases:
+            for qualname in _qualify(s.package, base), base:
+                dep = defined_in.get(qualname)
+                if dep is not None:
+                    break
+            if dep is not None and dep != s.filename:
+                deps[s.filename].add(dep)
+        for dep in deps[s.filename]:
+            users[dep].append(s.filename)
+
+    levels = []
+    level = [s.filename for s in scans if not deps[s.filename]]
+    nr_ordered = 0
+    while level:
+        levels.append(level)
+        nr_ordered += len(level)
+
+        next_level = []
+        for filename in level:
+            for user in users[filename]:
+                deps[user].discard(filename)
+                if not deps[user]:
+                    next_level.append(user)
+        level = next_level
+
+    if nr_ordered != len(deps):
+        cyclic = sorted(filename for filename, d in deps.items() if d)
+        raise ValueError('Circular inheritance between files: ' +
+                         ', '.join(cyclic))
+
+    return levels
+
+
+# Loading.
+
+class Packages(object):
+    """
+    Namespace of My-packages, owned by the loader.
+
+    Each package is a module object (not registered in sys.modules) whose
+    dict serves as the globals shared by all files of the package. Modules
+    of a package are thus visible by their bare names regardless of which
+    file defines them and when. Top-level packages are builtins of these
+    globals along with those of My-lang, so that other modules can be
+    referred to by their qualified names.
+
+    An instance is a new_module_globals function for the loader.
+    """
+
+    def __init__(self):
+        super(Packages, self).__init__()
+        self.modules = {}
+        self.builtins = dict(runtime.builtins)
+
+    def __getitem__(self, package):
+        return self.modules[package]
+
+    def __contains__(self, package):
+        return package in self.modules
+
+    def package_module(self, package):
+        """Returns a module object of the package, creating it (and its
+        parents) if necessary."""
+        try:
+            return self.modules[package]
+        except KeyError:
+            pass
+
+        module = self.modules[package] = types.ModuleType(package)
+        module.__package__ = package
+        module.__builtins__ = self.builtins
+
+        parent, _, name = package.rpartition('.')
+        if parent:
+            setattr(self.package_module(parent), name, module)
+        else:
+            self.builtins.setdefault(name, module)
+        return module
+
+    def __call__(self, filename, package):
+        if package is None:
+            return {
+                '__builtins__': self.builtins,
+                '__name__': filename,
+                '__package__': None,
+            }
+        return vars(self.package_module(package))
+
+class LoadedFile(namedtuple('_LoadedFile',
+                            'scan size module_globals modules')):
+    """A file built by iter_load_sources(): its FileScan, the length of its
+    source, the globals it was built into and a dict of its modules."""
+    __slots__ = ()
+
+# Set in the parent before forking the pool, inherited by the workers.
+_lexers = None
+
+def _parse_form(digest):
+    return my_parse_lexer(_lexers[digest])
+
+def _parse_forms(lexers, digests, jobs=1):
+    """Parses the lexers of the digests, and yields the forms in order."""
+    global _lexers
+
+    if jobs == 1 or len(digests) < 2:
+        for digest in digests:
+            yield my_parse_lexer(lexers.pop(digest))
+        return
+
+    nr_workers = jobs or multiprocessing.cpu_count()
+    _lexers = lexers
+    try:
+        pool = multiprocessing.get_context('fork').Pool(nr_workers)
+    finally:
+        _lexers = None
+
+    try:
+        for form in pool.imap(_parse_form, digests,
+                              max(1, len(digests) // (4 * nr_workers))):
+            yield form
+    finally:
+        pool.terminate()
+        pool.join()
+
+def iter_load_sources(sources, new_module_globals=None, jobs=1):
+    """
+    Parses (filename, source) pairs in the order of inheritance of their
+    modules, and yields a LoadedFile for each of them.
+
+    Files with identical contents (apart from the package declaration) are
+    parsed only once, and module classes are then built from the shared
+    MyForm separately for each package.
+
+    Unless jobs is 1, files are parsed in a pool of 'jobs' worker processes
+    (as many as there are CPUs if it is None), in the order they are built
+    in. Module classes can't be passed between processes, so they are built
+    in this one, as soon as the form of a file arrives, while the workers go
+    on with the next ones.
+
+    new_module_globals(filename, package) returns the globals to build
+    a file into, which also serve as the globals of its package. By default,
+    a new Packages namespace is used.
+    """
+    if new_module_globals is None:
+        new_module_globals = Packages()
+
+    scans = []
+    fileinfos = {}
+    lexers = {}  # digest -> lexer of the first file having it
+    for filename, source in sources:
+        lx = new_lexer(source, filename)
+        s = scan_lexer(lx)
+        scans.append(s)
+        fileinfos[filename] = lx.fileinfo
+        lexers.setdefault(s.digest, lx)
+
+    scans_by_filename = dict((s.filename, s) for s in scans)
+    order = [scans_by_filename[filename]
+             for level in load_levels(scans) for filename in level]
+
+    digests = list(OrderedDict.fromkeys(s.digest for s in order))
+    parsed = _parse_forms(lexers, digests, jobs)
+
+    forms = {}
+    for s in order:
+        try:
+            form = forms[s.digest]
+        except KeyError:
+            form = forms[s.digest] = next(parsed)
+        fileinfo = fileinfos.pop(s.filename)
+        module_globals = new_module_globals(s.filename, s.package)
+        modules = form.build(module_globals, fileinfo,
+                             (s.package, s.package_pos),
+                             package_globals=module_globals)
+        yield LoadedFile(s, len(fileinfo.source), module_globals, modules)
+
+def load_sources(sources, new_module_globals=None, jobs=1):
+    """Returns a dict mapping each filename to a dict of its modules, see
+    iter_load_sources()."""
+    return dict((loaded.scan.filename, loaded.modules)
+                for loaded in iter_load_sources(sources, new_module_globals,
+                                                jobs))
+
+def load(filenames, new_module_globals=None, cache=None, jobs=1):
+    """
+    Reads and loads the files, see load_sources().
+
+    With a cache (a ParseCache) given, files loaded into it previously are
+    not loaded again, and the newly loaded ones are added to it.
+    """
+    if cache is not None:
+        return cache.load(filenames, new_module_globals, jobs)
+    return load_sources(((filename, read_source(filename))
+                         for filename in filenames), new_module_globals, jobs)
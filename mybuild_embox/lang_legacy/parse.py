@@ -5,8 +5,13 @@ from _compat import *
 
 import functools
 import itertools
+import marshal
 import sys
+import types
+import weakref
+from array import array
 from collections import defaultdict
+from contextlib import contextmanager
 from operator import itemgetter
 
 import ply.yacc
@@ -27,6 +32,11 @@ tokens = lex.tokens
 
 
 # Location tracking.
+#
+# Positions are recorded as plain (lineno, lexpos) integer pairs in a per-parse
+# array, and a grammar symbol refers to its position by an index into that
+# array. AST nodes get their lineno/col_offset right from these integers, and
+# Location objects are only created to report an error.
 
 def node_loc(ast_node, p):
     return Location.from_ast_node(ast_node, p.lexer.fileinfo)
@@ -35,11 +45,33 @@ def ploc(p, i=1):
     i = min(i, len(p)-1)
     return Location(p.lexer.fileinfo, p.lineno(i), p.lexpos(i))
 
-def set_loc(ast_node, loc):
-    return loc.init_ast_node(ast_node)
+def pref(p, i=1):
+    i = min(i, len(p)-1)
+    locs = p.lexer.locs
+    ref = len(locs)
+    locs.append(p.lineno(i))
+    locs.append(p.lexpos(i))
+    return ref
+
+def ref_loc(p, ref):
+    locs = p.lexer.locs
+    return Location(p.lexer.fileinfo, locs[ref], locs[ref+1])
+
+def init_ast_node(ast_node, source, lineno, lexpos):
+    col_offset = lexpos - (source.rfind('\n', 0, lexpos) + 1)
+    ast_node.lineno = ast_node.end_lineno = lineno
+    ast_node.col_offset = ast_node.end_col_offset = col_offset
+    return ast_node
 
 def set_loc_p(ast_node, p, i=1):
-    return set_loc(ast_node, ploc(p, i))
+    i = min(i, len(p)-1)
+    return init_ast_node(ast_node, p.lexer.fileinfo.source,
+                         p.lineno(i), p.lexpos(i))
+
+def set_loc_ref(ast_node, p, ref):
+    locs = p.lexer.locs
+    return init_ast_node(ast_node, p.lexer.fileinfo.source,
+                         locs[ref], locs[ref+1])
 
 copy_loc = ast.copy_location
 
@@ -47,7 +79,7 @@ copy_loc = ast.copy_location
 def wloc(func):
     @functools.wraps(func)
     def decorated(p, *symbols):
-        return func(p, *symbols), ploc(p)
+        return func(p, *symbols), pref(p)
     return decorated
 
 def rule_wloc(func):
@@ -62,19 +94,30 @@ def name_builder(name):
             return ast.x_Name(name)
     return builder
 
-def build_node(builder_wloc, expr=None):
-    builder, loc = builder_wloc
+def build_node(p, builder_wloc, expr=None):
+    builder, ref = builder_wloc
     if not callable(builder):
         builder = name_builder(builder)
-    return set_loc(builder(expr) if expr is not None else builder(), loc)
+    return set_loc_ref(builder(expr) if expr is not None else builder(),
+                       p, ref)
 
-def build_chain(builder_wlocs, expr=None):
+def build_chain(p, builder_wlocs, expr=None):
     for builder_wloc in builder_wlocs:
-        expr = build_node(builder_wloc, expr)
+        expr = build_node(p, builder_wloc, expr)
     return expr
 
 
-def py_compile_func(p, expr, self_arg='self'):
+# Compilation.
+#
+# Expressions are compiled into code objects of lambdas right while parsing,
+# and kept in a per-parse list, so that a form built many times (or for many
+# files sharing it) compiles each of them once. Builders refer to a code
+# object by its index in the list, and bind it to the globals of the file
+# being built with _BuildContext.func().
+
+def py_compile(expr, filename, self_arg='self', lineno=1):
+    """Compiles expr (an AST or a string) into a code object evaluating to
+    a lambda of self_arg (unless it is None) returning its value."""
     try:
         if isinstance(expr, ast.AST):
             args = ast.x_arguments([ast.x_arg(self_arg)]
@@ -85,11 +128,10 @@ def py_compile_func(p, expr, self_arg='self'):
         else:
             ast_root = ast.parse('lambda {}: ({})'.format(self_arg or '',
                                                           expr),
-                                 p.lexer.fileinfo.name, mode='eval')
-            ast.increment_lineno(ast_root, p.lineno(0)-1)
+                                 filename, mode='eval')
+            ast.increment_lineno(ast_root, lineno-1)
 
-        code = compile(ast_root, p.lexer.fileinfo.name, mode='eval')
-        return eval(code, p.lexer.module_globals)
+        return compile(ast_root, filename, mode='eval')
 
     except SyntaxError as e:
         raise MySyntaxError(*e.args)
@@ -98,40 +140,182 @@ def py_compile_func(p, expr, self_arg='self'):
         print(ast.dump(ast_root, include_attributes=True))
         raise
 
-def py_eval(p, expr, **self_arg_value):
-    if len(self_arg_value) > 1:
-        raise ValueError('Too many keyword arguments')
-    try:
-        self_arg, self_value = self_arg_value.popitem()
-    except KeyError:
-        self_arg = None
-
-    func = py_compile_func(p, expr, self_arg)
+def pcode(p, expr, self_arg='self', lineno=1):
+    codes = p.lexer.codes
+    codes.append(py_compile(expr, p.lexer.fileinfo.name, self_arg, lineno))
+    return len(codes) - 1
 
-    if self_arg is not None:
-        return func(self_value)
-    else:
-        return func()
+def code_with_filename(code, filename):
+    """Returns the code object (and the ones nested in it) as if compiled
+    from another file."""
+    consts = tuple(code_with_filename(const, filename)
+                   if isinstance(const, types.CodeType) else const
+                   for const in code.co_consts)
+    return code.replace(co_filename=filename, co_consts=consts)
 
 
 class module(core.ModuleMetaBase):
     """An alias with a human-readable name."""
 
 
+# Evaluated 'depends' and 'files' lists not referring to 'self' are memoized
+# per class, and equal ones are shared between classes as long as any of
+# them is alive. Each instance still gets a list of its own.
+
+class _Members(object):
+    __slots__ = 'items', '__weakref__'
+
+    def __init__(self, items):
+        super(_Members, self).__init__()
+        self.items = items
+
+_interned_members = weakref.WeakValueDictionary()
+
+def intern_members(members):
+    items = tuple(members)
+    try:
+        interned = _interned_members.get(items)
+        if interned is None:
+            interned = _interned_members[items] = _Members(items)
+    except TypeError:  # unhashable elements
+        interned = _Members(items)
+    return interned
+
+def uses_self(expr):
+    return any(isinstance(node, ast.Name) and node.id == 'self'
+               for node in ast.walk(expr))
+
+def members_properties(func, attr, per_instance=True):
+    """Returns a dict of properties evaluating a list of members. Lists that
+    do not refer to 'self' are evaluated once per class, into a hidden
+    class attribute."""
+    if per_instance:
+        return {attr: cached_property(func, attr=attr)}
+
+    members_attr = '_{0}_members'.format(attr)
+    def fget_members(cls):
+        return intern_members(func(cls))
+    def fget(self):
+        return list(getattr(self, members_attr).items)
+
+    return {
+        members_attr: cached_class_property(fget_members, attr=members_attr),
+        attr: cached_property(fget, attr=attr),
+    }
+
+def materialize(modules):
+    """Evaluates all class-level members (annotations, and 'depends' or
+    'files' not referring to 'self') of each of the modules at once."""
+    for module in modules:
+        for klass in module.__mro__:
+            for attr, value in list(vars(klass).items()):
+                if isinstance(value, cached_class_property):
+                    getattr(module, attr)
+
+
+# Annotations of modules built while this is set are traced (see tracing).
+tracer = None
+
+
+# Rules of top-level entities do not evaluate anything while parsing.
+# Instead, they compile expressions and return builders, callables that take
+# a build context (see _BuildContext) and create objects in it. This way
+# a parsed file does not depend on the package it is loaded into, see MyForm.
+
+class _DebugBuilder(object):
+
+    def __init__(self, expr):
+        super(_DebugBuilder, self).__init__()
+        self.expr = expr
+
+    def __call__(self, ctx):
+        print(ctx.func(self.expr)(parser), file=sys.stderr)
+
+class _AnnotatedTypeBuilder(object):
+
+    def __init__(self, type_builder, annotations, default_impl=None):
+        super(_AnnotatedTypeBuilder, self).__init__()
+        self.type_builder = type_builder
+        self.annotations = annotations  # (name, code index, AST)
+        self.default_impl = default_impl
+
+    def __call__(self, ctx):
+        module_name, module = self.type_builder(ctx)
+        for name, index, value in self.annotations:
+            func = ctx.func(index)
+            if tracer is not None:
+                package = ctx.module_globals['__package__']
+                qualname = ('{0}.{1}'.format(package, module_name)
+                            if package is not None else module_name)
+                func = tracer.wrap(func, qualname, name,
+                                   Location.from_ast_node(value,
+                                                          ctx.fileinfo))
+            setattr(module, name, cached_class_property(func, attr=name))
+
+        if self.default_impl is not None:
+            module.default_provider = cached_class_property(
+                    ctx.func(self.default_impl), attr='default_provider')
+
+        ctx.module_globals[module_name] = module
+        ctx.package_globals[module_name] = module
+
+        return module_name, module
+
+class _ModuleTypeBuilder(object):
+
+    def __init__(self, name, module_class, module_ns, members_lists,
+                 super_module, options):
+        super(_ModuleTypeBuilder, self).__init__()
+        self.name = name
+        self.module_class = module_class
+        self.module_ns = module_ns
+        self.members_lists = members_lists  # (code index, per instance)
+        self.super_module = super_module
+        self.options = options
+
+    def __call__(self, ctx):
+        ns = dict(self.module_ns)
+
+        for prop_name, (index, per_instance) in self.members_lists.items():
+            ns.update(members_properties(ctx.func(index), prop_name,
+                                         per_instance))
+
+        if self.super_module is not None:
+            bases = (ctx.func(self.super_module)(),)
+        else:
+            bases = ()
+
+        ns['__module__'] = ctx.module_globals['__name__']
+
+        option_types = []
+        for index in self.options:
+            option = ctx.func(index)()
+            if hasattr(option, '__my_value__'):
+                option_ns = option.__dict__
+                option = option_ns.pop('__my_value__')[0]
+                option.__dict__.update(option_ns)
+            option_types.append((option._name, option))
+
+        meta = self.module_class._meta_for_base(option_types=option_types,
+                                                metaclass=module)
+        return (self.name, meta(self.name, bases, ns))
+
+
 @rule
-def p_my_file(p, package, imports, entities):
+def p_my_file(p, package_wloc, imports, entities, debug):
     """
     my_file : package imports entities debug
     """
-    # print package
-    return dict(entities)
+    # Entities are listed in reverse order, build them as they appear.
+    return MyForm(p.lexer.fileinfo, package_wloc, entities[::-1], debug,
+                  p.lexer.codes)
 
 @rule
 def p_debug(p, expr=-1):
     """
     debug : E_PRINT expr
     """
-    print(py_eval(p, expr, parser=p.parser), file=sys.stderr)
+    return _DebugBuilder(pcode(p, expr, self_arg='parser'))
 
 def p_nodebug(p):
     """
@@ -144,38 +328,31 @@ def p_package(p, qualname_wlocs=-1):
     """
     package : E_PACKAGE qualname
     """
-    qualname = '.'.join(name for name, loc in qualname_wlocs)
-    expected = p.lexer.module_globals['__package__']
-    if qualname != expected:
-        raise MySyntaxError("Package mismatch, expected '{expected}'"
-                            .format(**locals()), ploc(p, 2))
+    qualname = '.'.join(name for name, _ in qualname_wlocs)
+    return qualname, (p.lineno(2), p.lexpos(2))
 
 @rule
-def p_annotated_type(p, annotations, member_type):
+def p_annotated_type(p, annotations, type_builder):
     """
     annotated_type : annotations type
     """
-    module_name, module = member_type
+    default_impl = None
     for name, value in annotations:
-        func = py_compile_func(p, value)
-        setattr(module, name, cached_class_property(func, attr=name))
-
         if name == 'DefaultImpl':
-            func = py_compile_func(p, 'self.{}.__my_value__'.format(name))
-            module.default_provider = cached_class_property(func,
-                                        attr='default_provider')
-
-    p.lexer.module_globals[module_name] = module
-    p.lexer.package_globals[module_name] = module
+            default_impl = pcode(p, 'self.{}.__my_value__'.format(name),
+                                 lineno=p.lineno(0))
 
-    return member_type
+    return _AnnotatedTypeBuilder(type_builder,
+                                 [(name, pcode(p, value), value)
+                                  for name, value in annotations],
+                                 default_impl)
 
 @rule
-def p_type_module(p, module):
+def p_type_module(p, module_builder):
     """
     type : module_type
     """
-    return module
+    return module_builder
 
 # -------------------------------------------------
 # annotation type.
@@ -210,35 +387,23 @@ def p_module_type(p, modifier, name=3, super_module=4, module_members=-2):
         for k, v in module_members:
             members[k] += v
 
+    members_lists = {}
     for kind, prop_name in {'depends': 'depends',
                             'source': 'files'}.items():
         if kind in members:
             members_list = copy_loc(ast.List(members[kind], ast.Load()),
                                     members[kind][0])
-            func = py_compile_func(p, members_list)
-            module_ns[prop_name] = cached_property(func, attr=prop_name)
+            members_lists[prop_name] = (pcode(p, members_list),
+                                        uses_self(members_list))
 
     if super_module is not None:
-        bases = (py_eval(p, super_module),)
-    else:
-        bases = ()
-
-    module_ns['__module__'] = p.lexer.module_globals['__name__']
+        super_module = pcode(p, super_module, self_arg=None)
 
-    option_types = []
-    for option_ast in members['option']:
-        option = py_eval(p, option_ast)
-        if hasattr(option, '__my_value__'):
-            ns = option.__dict__
-            option = ns.pop('__my_value__')[0]
-            option.__dict__.update(ns)
-        option_types.append((option._name, option))
+    options = [pcode(p, option_ast, self_arg=None)
+               for option_ast in members['option']]
 
-    meta = module_class._meta_for_base(option_types=option_types,
-                                       metaclass=module)
-    ret_module = meta(name, bases, module_ns)
-
-    return (name, ret_module)
+    return _ModuleTypeBuilder(name, module_class, module_ns, members_lists,
+                              super_module, options)
 
 # (extends ...)?
 @rule
@@ -298,9 +463,10 @@ def p_option(p, optype, name_wloc, default_value):
     """
     option : option_type name option_default_value
     """
-    name, loc = name_wloc
+    name, ref = name_wloc
     ret = set_loc_p(ast.x_Call(ast.x_Name('__my_new_option__'),
-                               args=[set_loc(ast.Str(name), loc), optype]), p)
+                               args=[set_loc_ref(ast.Str(name), p, ref),
+                                     optype]), p)
     if default_value is not None:
         ret.args.append(default_value)
 
@@ -390,7 +556,7 @@ def p_annotation(p, name_wloc=2, trailers=3):
     """
     annotation : E_AT name trailers
     """
-    return name_wloc[0], build_chain(trailers, build_node(name_wloc))
+    return name_wloc[0], build_chain(p, trailers, build_node(p, name_wloc))
 
 
 def p_error(t):
@@ -413,13 +579,13 @@ def p_expr(p, expr):
 @rule
 def p_pyexpr(p, stub, builders):
     """pyexpr : pystub trailers"""
-    return build_chain(builders, stub)
+    return build_chain(p, builders, stub)
 
 @rule
 def p_stub(p, builder):
     """pystub : name
        pystub : pyatom"""
-    return build_node(builder)
+    return build_node(p, builder)
 
 
 @rule_wloc
@@ -489,12 +655,13 @@ def p_call(p, kw_arg_pairs=2):  # x(arg, kw=arg, ...)
             args.append(arg)
 
         else:
-            kw, loc = kw_wloc
+            kw, ref = kw_wloc
             if kw in seen_kw:
-                raise MySyntaxError('keyword argument repeated', loc)
+                raise MySyntaxError('keyword argument repeated',
+                                    ref_loc(p, ref))
             else:
                 seen_kw.add(kw)
-            keywords.append(set_loc(ast.keyword(kw, arg), loc))
+            keywords.append(set_loc_ref(ast.keyword(kw, arg), p, ref))
 
     return lambda expr: ast.x_Call(expr, args, keywords)
 
@@ -506,7 +673,7 @@ def p_argument_pos(p, value):
 @rule
 def p_argument_kw(p, key, value=3):
     """argument : ID EQUALS expr"""
-    kw_wloc = key, ploc(p)
+    kw_wloc = key, pref(p)
     return kw_wloc, value
 
 @rule_wloc
@@ -606,30 +773,133 @@ parser = ply.yacc.yacc(start='my_file',
                        errorlog=ply.yacc.NullLogger(), debug=False,
                        write_tables=False)
 
-def my_parse(source, filename="<unknown>", module_globals=None, **kwargs):
-    lx = lex.lexer.clone()
-
-    lx.fileinfo = Fileinfo(source, filename)
-
-    if module_globals is None:
-        module_globals = {'__name__': '__main__', '__package__': None}
-    lx.module_globals = module_globals
-
-    if module_globals['__package__'] is not None:
-        package_globals = sys.modules[module_globals['__package__']].__dict__
-    else:
-        package_globals = {}
-    lx.package_globals = package_globals
 
+@contextmanager
+def _syntax_errors(filename):
     try:
-        result = parser.parse(source, lexer=lx, tracking=True, **kwargs)
+        yield
     except (MySyntaxError, NotImplementedError) as e:
         raise SyntaxError(*e.args)
     except:
         print("Unable to parse '{}'".format(filename), file=sys.stderr)
         raise
 
-    return result
+
+class _BuildContext(object):
+
+    def __init__(self, fileinfo, module_globals, package_globals, codes):
+        super(_BuildContext, self).__init__()
+        self.fileinfo = fileinfo
+        self.module_globals = module_globals
+        self.package_globals = package_globals
+        self.codes = codes
+
+    def func(self, index):
+        """Returns a lambda compiled by pcode() bound to the module
+        globals."""
+        return eval(self.codes[index], self.module_globals)
+
+
+class MyForm(object):
+    """
+    Parsed My-file that is not yet bound to any package.
+
+    Holds the declared package, builders of the types defined in the file
+    and code objects of the expressions they evaluate. The same form can be
+    built any number of times, possibly into different packages, yielding
+    new module classes each time. A form can be pickled, e.g. to be parsed
+    in another process of the same interpreter.
+    """
+
+    def __init__(self, fileinfo, package_wloc, builders, debug=None,
+                 codes=()):
+        super(MyForm, self).__init__()
+        self.fileinfo = fileinfo
+        self.package_wloc = package_wloc
+        self.builders = builders
+        self.debug = debug
+        self.codes = codes
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['codes'] = marshal.dumps(tuple(self.codes))
+        return state
+
+    def __setstate__(self, state):
+        state['codes'] = list(marshal.loads(state['codes']))
+        self.__dict__.update(state)
+
+    def build(self, module_globals=None, fileinfo=None, package_wloc=None,
+              package_globals=None):
+        """
+        Creates module classes in module_globals and package_globals, which
+        default to the globals of the package module in sys.modules.
+
+        Another file with the same body, starting at the same line and
+        column, can be built from this form by passing its own fileinfo and
+        package_wloc, a pair of its declared package and the (lineno,
+        lexpos) of the latter.
+
+        Returns a dict of the defined types.
+        """
+        if fileinfo is None:
+            fileinfo = self.fileinfo
+        if package_wloc is None:
+            package_wloc = self.package_wloc
+
+        if module_globals is None:
+            module_globals = {'__name__': '__main__', '__package__': None}
+
+        if package_globals is None:
+            package = module_globals['__package__']
+            package_globals = (sys.modules[package].__dict__
+                               if package is not None else {})
+
+        codes = self.codes
+        if fileinfo.name != self.fileinfo.name:
+            codes = [code_with_filename(code, fileinfo.name)
+                     for code in codes]
+
+        ctx = _BuildContext(fileinfo, module_globals, package_globals, codes)
+
+        with _syntax_errors(fileinfo.name):
+            declared, (lineno, lexpos) = package_wloc
+            expected = module_globals['__package__']
+            if declared != expected:
+                raise MySyntaxError("Package mismatch, expected '{expected}'"
+                                    .format(**locals()),
+                                    Location(fileinfo, lineno, lexpos))
+
+            result = dict(build(ctx) for build in self.builders)
+            if self.debug is not None:
+                self.debug(ctx)
+
+        return result
+
+
+def my_parse_lexer(lx, source=None, **kwargs):
+    """
+    Parses tokens of a lexer having a fileinfo into a MyForm. Unless source
+    is None, it is fed into the lexer first.
+    """
+    lx.locs = array('l')
+    lx.codes = []
+
+    with _syntax_errors(lx.fileinfo.name):
+        return parser.parse(source, lexer=lx, tracking=True, **kwargs)
+
+def my_parse_form(source, filename="<unknown>", bulk=False, **kwargs):
+    """
+    Parses source into a MyForm. With bulk=True, the source is split into
+    tokens in a single pass before parsing (see lex.BulkLexer).
+    """
+    lx = lex.BulkLexer() if bulk else lex.lexer.clone()
+    lx.fileinfo = Fileinfo(source, filename)
+
+    return my_parse_lexer(lx, source, **kwargs)
+
+def my_parse(source, filename="<unknown>", module_globals=None, **kwargs):
+    return my_parse_form(source, filename, **kwargs).build(module_globals)
 
 if __name__ == "__main__":
     source = """
@@ -0,0 +1,119 @@
+"""
+Tracing of lazily evaluated annotations, to find slow Mybuild expressions.
+
+    tracer = tracing.enable()
+    ...  # load and resolve a configuration
+    tracing.disable()
+    tracer.report()
+
+Only modules built while tracing is enabled are traced.
+"""
+from __future__ import print_function
+
+from _compat import *
+
+import json
+import os
+import sys
+import time
+
+from mybuild_embox.lang_legacy import parse
+
+
+def format_location(location):
+    filename, lineno, offset = location.to_syntax_error_tuple()[:3]
+    return '{0}:{1}:{2}'.format(filename, lineno, offset)
+
+
+class _Stat(object):
+    __slots__ = 'module', 'attr', 'location', 'count', 'time'
+
+    def __init__(self, module, attr, location):
+        super(_Stat, self).__init__()
+        self.module = module
+        self.attr = attr
+        self.location = location
+        self.count = 0
+        self.time = 0.0
+
+
+class Tracer(object):
+    """
+    Records how many times each annotation of each module is evaluated and
+    how long it takes (including evaluation of anything it refers to).
+    """
+
+    def __init__(self):
+        super(Tracer, self).__init__()
+        self.stats = {}
+        self.events = []  # (stat, start, duration)
+        self._epoch = time.perf_counter()
+
+    def wrap(self, func, module, attr, location):
+        """Returns func recording its calls as evaluations of module.attr
+        defined at the location."""
+        key = module, attr
+        try:
+            stat = self.stats[key]
+        except KeyError:
+            stat = self.stats[key] = _Stat(module, attr, location)
+
+        events = self.events
+        def traced(obj):
+            start = time.perf_counter()
+            try:
+                return func(obj)
+            finally:
+                duration = time.perf_counter() - start
+                stat.count += 1
+                stat.time += duration
+                events.append((stat, start, duration))
+
+        return traced
+
+    def sorted_stats(self):
+        return sorted(self.stats.values(), key=lambda stat: stat.time,
+                      reverse=True)
+
+    def report(self, file=sys.stdout, limit=None):
+        """Prints evaluated annotations, the slowest first."""
+        stats = [stat for stat in self.sorted_stats() if stat.count]
+        print('{0:>10} {1:>6}  {2}'.format('time, ms', 'count', 'annotation'),
+              file=file)
+        for stat in stats[:limit]:
+            print('{0:10.3f} {1:6d}  {2}.{3}  ({4})'
+                  .format(stat.time * 1e3, stat.count, stat.module,
+                          stat.attr, format_location(stat.location)),
+                  file=file)
+
+    def chrome_trace(self):
+        """Returns evaluations in the Chrome trace event format (to be loaded
+        with chrome://tracing or Perfetto)."""
+        pid = os.getpid()
+        return {
+            'traceEvents': [{
+                'name': '{0}.{1}'.format(stat.module, stat.attr),
+                'cat': 'annotation',
+                'ph': 'X',
+                'ts': (start - self._epoch) * 1e6,
+                'dur': duration * 1e6,
+                'pid': pid,
+                'tid': 0,
+                'args': {'location': format_location(stat.location)},
+            } for stat, start, duration in self.events],
+            'displayTimeUnit': 'ms',
+        }
+
+    def dump_chrome_trace(self, file):
+        json.dump(self.chrome_trace(), file)
+
+
+def enable(tracer=None):
+    """Starts tracing annotations of modules built from now on."""
+    if tracer is None:
+        tracer = Tracer()
+    parse.tracer = tracer
+    return tracer
+
+def disable():
+    parse.tracer = None
@@ -0,0 +1,16 @@
+import pytest
+
+
+@pytest.fixture
+def write_tree(tmp_path):
+    """Writes {relative path: text} files and returns their paths in the
+    order of the dict."""
+    def write(files):
+        paths = []
+        for relpath, text in files.items():
+            path = tmp_path / relpath
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(text)
+            paths.append(str(path))
+        return paths
+    return write
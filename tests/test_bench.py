@@ -0,0 +1,17 @@
+import json
+import os
+
+from mybuild_embox.lang_legacy import bench
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_no_regressions():
+    layers = bench.Layers(bench.load_corpus(os.path.join(HERE,
+                                                         'bench_corpus')))
+    with open(os.path.join(HERE, 'bench_baseline.json')) as f:
+        baseline = json.load(f)
+
+    # Enough runs for the best relative times to be stable.
+    assert bench.compare(bench.measure(layers, repeat=10), baseline) == []
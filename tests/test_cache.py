@@ -0,0 +1,60 @@
+import gc
+import weakref
+from collections import OrderedDict
+
+import pytest
+
+from mybuild_embox.lang_legacy import loader
+from mybuild_embox.lang_legacy.cache import ParseCache
+
+
+@pytest.fixture
+def tree(write_tree):
+    return write_tree(OrderedDict([
+        ('b/Mybuild', 'package embox.b\n\nabstract module base {}\n'),
+        ('d/Mybuild', 'package embox.d\n\n'
+                      'module derived extends embox.b.base {}\n'),
+        ('u/Mybuild', 'package embox.u\n\n'
+                      'module user { depends embox.d.derived }\n'),
+        ('o/Mybuild', 'package embox.o\n\nmodule other {}\n'),
+    ]))
+
+
+def test_active_deps_are_kept(tree):
+    base, derived, user, other = tree
+    cache = ParseCache(budget=1)
+
+    loader.load([base, derived, user], cache=cache)
+    cache.activate([user])
+    loader.load([other], cache=cache)
+
+    assert base in cache and derived in cache and user in cache
+    assert other in cache  # the file just loaded is kept as well
+    cache.activate([user])
+    assert other not in cache
+
+    result = loader.load([user], cache=cache)
+    assert list(result[user]['user']().depends) == [
+        cache.packages['embox.d'].derived]
+
+    with pytest.raises(ValueError):
+        cache.evict(base)
+
+
+def test_users_are_evicted_along(tree):
+    base, derived, user, other = tree
+    cache = ParseCache()
+
+    result = loader.load([base, derived, user, other], cache=cache)
+    old_base = weakref.ref(result[base]['base'])
+    del result
+
+    cache.evict(base)
+    gc.collect()
+
+    assert old_base() is None
+    assert base not in cache and derived not in cache and user not in cache
+    assert other in cache
+
+    result = loader.load([derived, base], cache=cache)
+    assert issubclass(result[derived]['derived'], result[base]['base'])
@@ -0,0 +1,55 @@
+from collections import OrderedDict
+
+from mybuild_embox.lang_legacy import configs
+
+
+def test_unpicklable_results(write_tree):
+    tree, good, bad = write_tree(OrderedDict([
+        ('a/Mybuild', 'package embox.a\n\nmodule x {}\n'),
+        ('conf/good.config', 'package genconfig\n\n'
+                             'configuration good { include embox.a.x }\n'),
+        ('conf/bad.config', 'package genconfig\n\n'
+                            'configuration bad { include embox.a.x }\n'),
+    ]))
+
+    def evaluate(modules):
+        if 'good' in modules:
+            return sorted(modules)
+        return lambda: modules
+
+    results = dict((result.filename, result) for result in
+                   configs.evaluate_configs([tree], [good, bad], evaluate,
+                                            jobs=2))
+
+    assert results[good] == (good, ['good'], None)
+    assert results[bad].value is None
+    assert isinstance(results[bad].error, configs.ConfigError)
+
+
+def test_configs_do_not_see_each_other(write_tree):
+    probe = 'module probe { depends one }\n'
+    tree, one, two = write_tree(OrderedDict([
+        ('a/Mybuild', 'package embox.a\n\nmodule x {}\n'),
+        ('conf/one.config', 'package genconfig\n\n'
+                            'configuration conf { include embox.a.x }\n'
+                            'module one {}\n' + probe),
+        ('conf/two.config', 'package genconfig\n\n'
+                            'configuration conf { include embox.a.x }\n'
+                            'module two {}\n' + probe),
+    ]))
+
+    def evaluate(modules):
+        x, = modules['conf']().depends
+        x.seen = getattr(x, 'seen', []) + sorted(modules)
+        try:
+            modules['probe']().depends
+        except NameError:
+            return x.seen, False
+        return x.seen, True
+
+    results = dict((result.filename, result.value) for result in
+                   configs.evaluate_configs([tree], [one, two], evaluate,
+                                            jobs=1))
+
+    assert results[one] == (['conf', 'one', 'probe'], True)
+    assert results[two] == (['conf', 'probe', 'two'], False)
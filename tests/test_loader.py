@@ -0,0 +1,111 @@
+from collections import OrderedDict
+
+import pytest
+
+from mybuild_embox.lang_legacy import loader
+
+
+def test_sibling_defined_in_a_later_file(write_tree):
+    a, b = write_tree(OrderedDict([
+        ('p/A.my', 'package embox.p\n\nmodule first { depends second }\n'),
+        ('p/B.my', 'package embox.p\n\nmodule second {}\n'),
+    ]))
+    result = loader.load([a, b])
+
+    first = result[a]['first']
+    second = result[b]['second']
+    assert list(first().depends) == [second]
+
+
+def test_base_in_another_file(write_tree):
+    derived, base = write_tree(OrderedDict([
+        ('d/Mybuild', 'package embox.d\n\n'
+                      'module derived extends embox.b.base {}\n'),
+        ('b/Mybuild', 'package embox.b\n\nabstract module base {}\n'),
+    ]))
+    scans = [loader.scan_file(derived), loader.scan_file(base)]
+    assert loader.load_levels(scans) == [[base], [derived]]
+
+    result = loader.load([derived, base])
+    assert issubclass(result[derived]['derived'], result[base]['base'])
+
+
+def test_circular_inheritance(write_tree):
+    filenames = write_tree(OrderedDict([
+        ('a/Mybuild', 'package embox.a\n\nmodule x extends embox.b.y {}\n'
+                      'module z {}\n'),
+        ('b/Mybuild', 'package embox.b\n\nmodule y extends embox.a.z {}\n'),
+    ]))
+    with pytest.raises(ValueError):
+        loader.load(filenames)
+
+
+def _last_frame(excinfo):
+    tb = excinfo.tb
+    while tb.tb_next is not None:
+        tb = tb.tb_next
+    return tb.tb_frame.f_code.co_filename, tb.tb_lineno
+
+def test_duplicate_bodies(write_tree, monkeypatch):
+    body = '\n@Cflags(undefined)\nmodule y {}\n'
+    b, b2, b3 = write_tree(OrderedDict([
+        ('b/Mybuild', '// a longer\n// header\n// comment\n'
+                      'package embox.b\n' + body),
+        ('b2/Mybuild', 'package embox.b2\n' + body),
+        ('b3/Mybuild', 'package embox.b3\n' + body),
+    ]))
+
+    parsed = []
+    my_parse_lexer = loader.my_parse_lexer
+    def counting_parse(lx, *args, **kwargs):
+        parsed.append(lx.fileinfo.name)
+        return my_parse_lexer(lx, *args, **kwargs)
+    monkeypatch.setattr(loader, 'my_parse_lexer', counting_parse)
+
+    result = loader.load([b, b2, b3])
+    assert sorted(parsed) == sorted([b, b2])  # b3 shares the form of b2
+
+    for filename, lineno in (b, 6), (b2, 3), (b3, 3):
+        with pytest.raises(NameError) as excinfo:
+            result[filename]['y'].Cflags
+        assert _last_frame(excinfo) == (filename, lineno)
+
+
+def test_python_modules_are_not_packages(write_tree):
+    import json
+    import sys
+
+    dumps = json.dumps
+    saved_modules = dict(sys.modules)
+
+    a, b = write_tree(OrderedDict([
+        ('json/Mybuild', 'package json\n\nmodule dumps {}\n'),
+        ('p/Mybuild', 'package platform.qemu\n\n'
+                      'module x { depends json.dumps }\n'),
+    ]))
+    packages = loader.Packages()
+    result = loader.load([a, b], packages)
+
+    assert json.dumps is dumps
+    assert sys.modules == saved_modules
+    assert packages.builtins['json'] is packages['json']
+    assert list(result[b]['x']().depends) == [result[a]['dumps']]
+
+
+def test_parallel_load(write_tree):
+    filenames = write_tree(OrderedDict(
+        [('p{0}/Mybuild'.format(i),
+          'package embox.p{0}\n\n'
+          '@Runlevel({0})\n'
+          'module m{0}{1} {{ depends embox.base.b }}\n'
+          .format(i, ' extends embox.base.b' if i % 2 else ''))
+         for i in range(6)] +
+        [('base/Mybuild', 'package embox.base\n\nabstract module b {}\n')]))
+
+    result = loader.load(filenames, jobs=2)
+    base = result[filenames[-1]]['b']
+    for i, filename in enumerate(filenames[:-1]):
+        module = result[filename]['m{0}'.format(i)]
+        assert module.Runlevel.__my_value__ == i
+        assert issubclass(module, base) == bool(i % 2)
+        assert list(module().depends) == [base]
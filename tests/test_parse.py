@@ -0,0 +1,67 @@
+import gc
+from collections import OrderedDict
+
+import pytest
+
+from mybuild_embox.lang_legacy import loader
+from mybuild_embox.lang_legacy import parse
+from mylang.location import Fileinfo
+
+
+def test_shared_members(write_tree):
+    a, = write_tree(OrderedDict([
+        ('a/Mybuild', 'package embox.a\n\nmodule dep {}\n'
+                      'module x { depends dep }\n'
+                      'module y { depends dep }\n'),
+    ]))
+    modules = loader.load([a])[a]
+    x, y = modules['x'], modules['y']
+    parse.materialize([x, y])
+
+    assert x._depends_members is y._depends_members
+    assert x().depends == [modules['dep']]
+    assert x().depends is not x().depends
+
+
+
+def test_interned_members_are_not_kept():
+    class Module(object):
+        pass
+
+    gc.collect()
+    nr_interned = len(parse._interned_members)
+    members = parse.intern_members([Module])
+    assert parse.intern_members([Module]) is members
+    assert len(parse._interned_members) == nr_interned + 1
+
+    del members
+    gc.collect()
+    assert len(parse._interned_members) == nr_interned
+
+
+def test_shared_form_is_compiled_once(monkeypatch):
+    compiled = []
+    py_compile = parse.py_compile
+    def counting_compile(*args, **kwargs):
+        compiled.append(args)
+        return py_compile(*args, **kwargs)
+    monkeypatch.setattr(parse, 'py_compile', counting_compile)
+
+    source = ('package embox.a\n\n'
+              'module x { depends y }\nmodule y {}\n'
+              'module z { depends missing }\n')
+    form = parse.my_parse_form(source, 'a/Mybuild', bulk=True)
+    nr_compiled = len(compiled)
+    assert nr_compiled
+
+    for filename in 'a/Mybuild', 'b/Mybuild':
+        module_globals = {'__name__': 'embox.a', '__package__': 'embox.a'}
+        modules = form.build(module_globals, Fileinfo(source, filename),
+                             package_globals=module_globals)
+        assert modules['x']().depends == [modules['y']]
+
+        with pytest.raises(NameError) as excinfo:
+            modules['z']().depends
+        assert str(excinfo.traceback[-1].path) == filename
+
+    assert len(compiled) == nr_compiled
@@ -0,0 +1,33 @@
+from collections import OrderedDict
+
+from mybuild_embox.lang_legacy import loader
+from mybuild_embox.lang_legacy import tracing
+
+
+def test_trace_names_and_locations(write_tree):
+    body = '\n@Runlevel(2)\nmodule y {}\n'
+    b, b2 = write_tree(OrderedDict([
+        ('b/Mybuild', '// header\npackage embox.b\n' + body),
+        ('b2/Mybuild', 'package embox.b2\n' + body),
+    ]))
+
+    tracer = tracing.enable()
+    try:
+        result = loader.load([b, b2])
+    finally:
+        tracing.disable()
+
+    result[b]['y'].Runlevel
+    result[b]['y'].Runlevel
+    result[b2]['y'].Runlevel
+
+    stats = dict(((stat.module, stat.attr), stat)
+                 for stat in tracer.sorted_stats())
+    assert sorted(stats) == [('embox.b.y', 'Runlevel'),
+                             ('embox.b2.y', 'Runlevel')]
+
+    stat = stats['embox.b.y', 'Runlevel']
+    assert stat.count == 1  # the value is cached after the first access
+    assert stat.location.to_syntax_error_tuple()[:2] == (b, 4)
+    stat = stats['embox.b2.y', 'Runlevel']
+    assert stat.location.to_syntax_error_tuple()[:2] == (b2, 3)